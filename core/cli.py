@@ -1,13 +1,46 @@
 import argparse
+import mmap
+import os
+import tempfile
 from pathlib import Path
 from .core import process_markdown, clear_outputs
 from .languages import write_default_config
 
+
+# Above this size, map the file instead of reading it: the scanner works
+# directly on the mapping, so no whole-document copy is ever made.
+_MMAP_THRESHOLD = 1 << 20
+
+
+def _read_bytes(path: Path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size >= _MMAP_THRESHOLD:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
+
+
+def _write_bytes(path: Path, data: bytes) -> None:
+    # Write to a sibling tempfile and os.replace it over the target so a
+    # crash mid-write can never leave a truncated markdown file behind.
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
 def main():
     parser = argparse.ArgumentParser(description="Run code in Markdown files like a notebook")
     parser.add_argument("file", type=str, help="Markdown file to process")
     parser.add_argument("-c", "--clear", action="store_true", help="Clear outputs only")
     parser.add_argument("--init-config", action="store_true", help="Create ~/.config/runmd/languages.yml with sensible defaults")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Max number of code blocks to execute concurrently")
+    parser.add_argument("--inproc", action="store_true", help="Run python blocks in-process with a shared namespace (trusted input only)")
     args = parser.parse_args()
 
     if args.init_config:
@@ -21,14 +54,14 @@ def main():
         print(f"File not found: {md_path}")
         return
 
-    md_text = md_path.read_text()
+    md_data = _read_bytes(md_path)
 
     if args.clear:
-        new_text = clear_outputs(md_text)
-        md_path.write_text(new_text)
+        new_data = clear_outputs(md_data)
+        _write_bytes(md_path, new_data)
         print(f"Cleared outputs in {md_path}")
         return
 
-    new_text = process_markdown(md_text)
-    md_path.write_text(new_text)
+    new_data = process_markdown(md_data, jobs=args.jobs, inproc=args.inproc)
+    _write_bytes(md_path, new_data)
     print(f"Processed {md_path}")
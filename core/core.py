@@ -1,51 +1,192 @@
+import os
 import re
-from .runner import run_code
+from concurrent.futures import ThreadPoolExecutor
+from .runner import run_code, run_python_inproc, uses_python_worker
 from .languages import load_languages
 
-def clear_outputs(md_text: str) -> str:
-    pattern = r"(```\w+\n[\s\S]*?```)(?:\n)?\*\*Output:?\*\*\n```[\s\S]*?```(?:\n)?"
-    cleaned = re.sub(pattern, r"\1", md_text, flags=re.DOTALL)
+_LANG_RE = re.compile(rb"\w+\Z")
 
-    def _trim_code_trailing(match: re.Match) -> str:
-        lang = match.group(1)
-        code = match.group(2)
-        new_code = code.rstrip('\n')
-        return f"```{lang}\n{new_code}\n```"
+_OUTPUT_MARKERS = (b"\n**Output**\n```", b"\n**Output:**\n```",
+                   b"**Output**\n```", b"**Output:**\n```")
 
-    cleaned = re.sub(r"```(\w+)\n([\s\S]*?)```", _trim_code_trailing, cleaned, flags=re.DOTALL)
-    cleaned = re.sub(r'```(?=```)', '```\n\n', cleaned)
-    cleaned = re.sub(r'```\n(?=```)', '```\n\n', cleaned)
 
-    return cleaned
+def _is_fence_lang(lang: bytes) -> bool:
+    return _LANG_RE.match(lang) is not None
 
-def process_markdown(md_text: str) -> str:
-    command_map = load_languages()
-    md_text = clear_outputs(md_text)
 
-    def repl(match: re.Match) -> str:
-        lang = match.group(1)
-        code = match.group(2)
+def _iter_fences(data: bytes):
+    """Walk data once and yield one tuple per fenced code block:
+    (start, lang, code_start, code_end, fence_end, output_end) where
+    output_end is the end of a trailing **Output** block, or None if the
+    fence has no attached output."""
+    pos = 0
+    while True:
+        start = data.find(b"```", pos)
+        if start == -1:
+            return
+        if start > 0 and data[start - 1:start] != b"\n":
+            pos = start + 3
+            continue
+
+        lang_end = data.find(b"\n", start + 3)
+        if lang_end == -1:
+            return
+        lang = data[start + 3:lang_end]
+        if not _is_fence_lang(lang):
+            pos = start + 3
+            continue
+
+        close = data.find(b"\n```", lang_end)
+        if close == -1:
+            return
+        code_start = lang_end + 1
+        code_end = close + 1
+        fence_end = close + 4
+
+        output_end = None
+        for marker in _OUTPUT_MARKERS:
+            # slice-compare instead of startswith so mmap objects work too
+            if data[fence_end:fence_end + len(marker)] == marker:
+                out_close = data.find(b"```", fence_end + len(marker))
+                if out_close != -1:
+                    output_end = out_close + 3
+                    if data[output_end:output_end + 1] == b"\n":
+                        output_end += 1
+                break
+
+        yield start, lang, code_start, code_end, fence_end, output_end
+        pos = output_end if output_end is not None else fence_end
 
-        if lang.lower() == "racket":
-            lines = code.splitlines()
-            if not lines or not lines[0].startswith("#lang"):
-                lines.insert(0, "#lang racket")
-            code_to_run = "\n".join(lines)
+
+def _clear_outputs_bytes(data) -> bytes:
+    if data.find(b"```") == -1:
+        return data if isinstance(data, bytes) else bytes(data)
+    # Accumulate into one growable buffer rather than a list of slices plus
+    # a join pass, which would copy the whole document a second time.
+    out = bytearray()
+    last = 0
+    for start, lang, code_start, code_end, fence_end, output_end in _iter_fences(data):
+        # A gap of one byte is always the newline preceding the next fence;
+        # a zero gap happens when a stripped output block's trailing newline
+        # was consumed. Normalize both to a blank line so fences never glue
+        # together and reprocessing stays stable.
+        if last and start - last <= 1:
+            out += b"\n\n"
         else:
-            code_to_run = code
+            out += data[last:start]
+        out += b"```"
+        out += lang
+        out += b"\n"
+        out += data[code_start:code_end].rstrip(b"\n")
+        out += b"\n```"
+        last = output_end if output_end is not None else fence_end
+    out += data[last:]
+    return bytes(out)
+
 
-        output = run_code(lang, code_to_run, command_map).strip()
+def _process_markdown_bytes(data, jobs: int = None, inproc: bool = False) -> bytes:
+    command_map = load_languages()
+    if data.find(b"**Output") != -1:
+        data = _clear_outputs_bytes(data)
 
-        if code.endswith("\n"):
-            code_fence = f"```{lang}\n{code}```"
+    parts = []
+    blocks = []
+    last = 0
+    for start, lang, code_start, code_end, fence_end, output_end in _iter_fences(data):
+        # Same blank-line normalization as _clear_outputs_bytes, so a first
+        # run never emits the fragile single-newline fence layout.
+        if last and start - last <= 1:
+            parts.append(b"\n\n")
         else:
-            code_fence = f"```{lang}\n{code}\n```"
+            parts.append(data[last:start])
+
+        if output_end is not None:
+            # Fence already carries an **Output** block (formerly the
+            # negative lookahead in the fence regex): leave it untouched.
+            parts.append(data[start:output_end])
+            last = output_end
+            continue
+
+        blocks.append((lang, data[code_start:code_end]))
+        parts.append(None)
+        last = fence_end
+    parts.append(data[last:])
+
+    if blocks:
+        work = [(lang.decode("utf-8", errors="replace"),
+                 code.decode("utf-8", errors="replace"))
+                for lang, code in blocks]
+        if inproc:
+            # In-process python blocks share a namespace, so document order
+            # matters: run everything serially.
+            namespace: dict = {}
+            outputs = []
+            for lang, code in work:
+                if lang.lower() in ("python", "py"):
+                    outputs.append(run_python_inproc(code, namespace))
+                else:
+                    outputs.append(run_code(lang, code, command_map))
+        else:
+            # Blocks bound for the persistent python worker share its
+            # namespace, so they must run in document order on one thread;
+            # everything else is stateless and can go to the pool.
+            serial_idx = []
+            pooled_idx = []
+            for i, (lang, _) in enumerate(work):
+                (serial_idx if uses_python_worker(lang, command_map)
+                 else pooled_idx).append(i)
+
+            outputs: list = [None] * len(work)
+            max_workers = min(len(pooled_idx), jobs or (os.cpu_count() or 4))
+            if max_workers > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [(i, executor.submit(run_code, work[i][0],
+                                                   work[i][1], command_map))
+                               for i in pooled_idx]
+                    for i in serial_idx:
+                        outputs[i] = run_code(work[i][0], work[i][1], command_map)
+                    for i, future in futures:
+                        outputs[i] = future.result()
+            else:
+                for i in range(len(work)):
+                    outputs[i] = run_code(work[i][0], work[i][1], command_map)
+
+        block_idx = 0
+        for i, part in enumerate(parts):
+            if part is not None:
+                continue
+            lang, code = blocks[block_idx]
+            output = outputs[block_idx].strip()
+            block_idx += 1
+
+            if code.endswith(b"\n"):
+                code_fence = b"```" + lang + b"\n" + code + b"```"
+            else:
+                code_fence = b"```" + lang + b"\n" + code + b"\n```"
+
+            output_block = b"**Output**\n```\n" + output.rstrip("\n").encode("utf-8") + b"\n```"
+            parts[i] = code_fence + b"\n" + output_block
+
+    return b"".join(parts)
 
-        output_text = output.rstrip("\n") if output is not None else ""
 
-        output_block = f"**Output**\n```\n{output_text}\n```"
+def clear_outputs(md_text):
+    """Remove **Output** blocks and normalize fences. Accepts str or any
+    bytes-like object (bytes, bytearray, mmap); str in means str out, any
+    buffer in means bytes out. The scan itself always runs on bytes."""
+    if isinstance(md_text, str):
+        return _clear_outputs_bytes(md_text.encode("utf-8")).decode("utf-8")
+    if isinstance(md_text, memoryview):
+        md_text = bytes(md_text)
+    return _clear_outputs_bytes(md_text)
 
-        return code_fence + "\n" + output_block
 
-    fence_pattern = r"```(\w+)\n([\s\S]*?)```(?!\n\*\*Output:?\*\*)"
-    return re.sub(fence_pattern, repl, md_text, flags=re.DOTALL)
+def process_markdown(md_text, jobs: int = None, inproc: bool = False):
+    """Execute every code block and splice its **Output** in. Accepts str or
+    any bytes-like object (bytes, bytearray, mmap); str in means str out, any
+    buffer in means bytes out. The scan itself always runs on bytes."""
+    if isinstance(md_text, str):
+        return _process_markdown_bytes(md_text.encode("utf-8"), jobs, inproc).decode("utf-8")
+    if isinstance(md_text, memoryview):
+        md_text = bytes(md_text)
+    return _process_markdown_bytes(md_text, jobs, inproc)
@@ -1,54 +1,79 @@
+import functools
 import os
 import shutil
-from typing import Dict, Callable
+from typing import Dict, Optional, Tuple
 
 try:
     import yaml  # type: ignore
+    try:
+        from yaml import CSafeLoader as _SafeLoader  # libyaml, ~10x faster
+    except ImportError:
+        from yaml import SafeLoader as _SafeLoader
     YAML_AVAILABLE = True
 except Exception:
     yaml = None
+    _SafeLoader = None
     YAML_AVAILABLE = False
 
 
-DEFAULT_LANGUAGES: Dict[str, Callable[[str], list]] = {
-    "python": lambda f: ["python3", f],
-    "py": lambda f: ["python3", f],
-    "racket": lambda f: ["racket", f],
-    "bash": lambda f: ["bash", f],
-    "sh": lambda f: ["sh", f],
-    "javascript": lambda f: ["node", f],
-    "ruby": lambda f: ["ruby", f],
-    "php": lambda f: ["php", f],
-    "julia": lambda f: ["julia", f],
-    "lua": lambda f: ["lua", f],
-    "r": lambda f: ["Rscript", f],
-    "rust": lambda f: ["sh", "-c", f"rustc {f} -o /tmp/runmd_rust && /tmp/runmd_rust"],
-    "go": lambda f: ["go", "run", f],
-    "java": lambda f: ["sh", "-c", f"javac {f} && java {os.path.splitext(os.path.basename(f))[0]}"],
-    "cpp": lambda f: ["sh", "-c", f"g++ {f} -o /tmp/runmd_cpp && /tmp/runmd_cpp"],
-    "c": lambda f: ["sh", "-c", f"gcc {f} -o /tmp/runmd_c && /tmp/runmd_c"],
+# argv templates: {file} is the source path, {stem} its basename sans extension.
+DEFAULT_LANGUAGES: Dict[str, Tuple[str, ...]] = {
+    "python": ("python3", "{file}"),
+    "py": ("python3", "{file}"),
+    "racket": ("racket", "{file}"),
+    "bash": ("bash", "{file}"),
+    "sh": ("sh", "{file}"),
+    "javascript": ("node", "{file}"),
+    "ruby": ("ruby", "{file}"),
+    "php": ("php", "{file}"),
+    "julia": ("julia", "{file}"),
+    "lua": ("lua", "{file}"),
+    "r": ("Rscript", "{file}"),
+    "rust": ("sh", "-c", "rustc {file} -o /tmp/runmd_rust && /tmp/runmd_rust"),
+    "go": ("go", "run", "{file}"),
+    "java": ("sh", "-c", "javac {file} && java {stem}"),
+    "cpp": ("sh", "-c", "g++ {file} -o /tmp/runmd_cpp && /tmp/runmd_cpp"),
+    "c": ("sh", "-c", "gcc {file} -o /tmp/runmd_c && /tmp/runmd_c"),
 }
 
 
+def build_cmd(template: Tuple[str, ...], fpath: str) -> list:
+    stem = os.path.splitext(os.path.basename(fpath))[0]
+    return [part.replace("{file}", fpath).replace("{stem}", stem)
+            for part in template]
+
+
+# Interpreters that accept source on stdin, letting run_code skip the
+# tempfile round-trip entirely. Compiled languages still need a real file.
+STDIN_CAPABLE: Dict[str, list] = {
+    "python": ["python3", "-"],
+    "py": ["python3", "-"],
+    "bash": ["bash", "-s"],
+    "sh": ["sh", "-s"],
+    "javascript": ["node", "-"],
+    "ruby": ["ruby"],
+    "php": ["php"],
+    "lua": ["lua", "-"],
+}
+
+
+@functools.lru_cache(maxsize=64)
+def _which_cached(name: str) -> Optional[str]:
+    return shutil.which(name)
+
+
 def check_dependency_exists(cmd):
     if isinstance(cmd, list):
         base_cmd = cmd[0]
     else:
         base_cmd = cmd.split()[0]
-    return shutil.which(base_cmd) is not None
+    return _which_cached(base_cmd) is not None
 
 
 def write_default_config(path: str) -> None:
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
-    serializable = {}
-    for k, v in DEFAULT_LANGUAGES.items():
-        try:
-            cmd_list = v("{file}")
-            cmd_str = " ".join(cmd_list)
-        except Exception:
-            cmd_str = str(v)
-        serializable[k] = cmd_str
+    serializable = {k: " ".join(tmpl) for k, tmpl in DEFAULT_LANGUAGES.items()}
 
     with open(path, "w", encoding="utf-8") as f:
         if YAML_AVAILABLE:
@@ -58,25 +83,38 @@ def write_default_config(path: str) -> None:
                 f.write(f"{k}: {v}\n")
 
 
+_LANG_CACHE: Dict[tuple, Dict[str, Tuple[str, ...]]] = {}
+
+
 def load_languages():
     cfg_dir = os.path.expanduser("~/.config/runmd")
     config_path = os.path.join(cfg_dir, "languages.config")
+
+    try:
+        mtime_ns = os.stat(config_path).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+
+    cache_key = (config_path, mtime_ns)
+    cached = _LANG_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
     user_langs = None
-    if os.path.exists(config_path) and YAML_AVAILABLE:
+    if mtime_ns is not None and YAML_AVAILABLE:
         try:
             with open(config_path, "r", encoding="utf-8") as f:
-                user_langs = yaml.safe_load(f) or {}
+                user_langs = yaml.load(f, Loader=_SafeLoader) or {}
         except Exception:
             user_langs = None
 
     user_map = {}
     if user_langs:
         for k, v in user_langs.items():
-            cmd_template = str(v)
-
-            def make_cmd(template: str):
-                return lambda fpath, t=template: (t.format(file=fpath)).split()
-
-            user_map[k] = make_cmd(cmd_template)
+            # Same argv-template shape as DEFAULT_LANGUAGES: split once at
+            # config-load time, substitute placeholders per block in build_cmd.
+            user_map[k] = tuple(str(v).split())
 
-    return {**DEFAULT_LANGUAGES, **user_map}
+    merged = {**DEFAULT_LANGUAGES, **user_map}
+    _LANG_CACHE[cache_key] = merged
+    return merged
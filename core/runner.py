@@ -1,38 +1,268 @@
+import atexit
+import contextlib
+import functools
+import hashlib
+import io
+import shutil
 import subprocess
 import tempfile
+import threading
 import os
-from .languages import check_dependency_exists
+from .languages import build_cmd, check_dependency_exists, DEFAULT_LANGUAGES, STDIN_CAPABLE
+
+_scratch_dir = None
+_scratch_files: dict = {}
+_scratch_lock = threading.Lock()
+
+
+def _scratch_path(lang: str, suffix: str):
+    """Return (path, lock) for the reusable per-language scratch file.
+
+    One file per language is overwritten for each block instead of creating
+    and unlinking a fresh tempfile every time; the lock serializes blocks of
+    the same language, whose compile commands share fixed output paths."""
+    global _scratch_dir
+    with _scratch_lock:
+        if _scratch_dir is None:
+            _scratch_dir = tempfile.mkdtemp(prefix="runmd_")
+            atexit.register(shutil.rmtree, _scratch_dir, ignore_errors=True)
+        entry = _scratch_files.get(lang)
+        if entry is None:
+            entry = (os.path.join(_scratch_dir, f"block_{lang}{suffix}"), threading.Lock())
+            _scratch_files[lang] = entry
+    return entry
+
+
+def _drain(pipe, chunks: list) -> None:
+    for chunk in iter(lambda: pipe.read(65536), b""):
+        chunks.append(chunk)
+    pipe.close()
+
+
+def _feed(pipe, data: bytes) -> None:
+    try:
+        pipe.write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+def _run_streaming(cmd, timeout, input_bytes: bytes = None):
+    """Run cmd, draining stdout/stderr concurrently instead of buffering via
+    capture_output, and decode once at the end. Returns (returncode, out, err)."""
+    proc = subprocess.Popen(cmd, shell=False,
+                            stdin=subprocess.PIPE if input_bytes is not None else None,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out_chunks: list = []
+    err_chunks: list = []
+    readers = [
+        threading.Thread(target=_drain, args=(proc.stdout, out_chunks), daemon=True),
+        threading.Thread(target=_drain, args=(proc.stderr, err_chunks), daemon=True),
+    ]
+    if input_bytes is not None:
+        readers.append(threading.Thread(target=_feed, args=(proc.stdin, input_bytes), daemon=True))
+    for t in readers:
+        t.start()
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        for t in readers:
+            t.join()
+    out = b"".join(out_chunks).decode("utf-8", errors="replace")
+    err = b"".join(err_chunks).decode("utf-8", errors="replace")
+    return proc.returncode, out, err
+
+
+# Long-lived interpreter child reused across blocks: reads code chunks
+# terminated by __RUNMD_END__, execs them in one persistent namespace, and
+# echoes __RUNMD_DONE__ after each block's output.
+_WORKER_SCRIPT = r"""
+import contextlib, io, sys, traceback
+ns = {}
+lines = []
+for line in sys.stdin:
+    if line != "__RUNMD_END__\n":
+        lines.append(line)
+        continue
+    code = "".join(lines)
+    lines = []
+    out_buf = io.StringIO()
+    err_buf = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out_buf), contextlib.redirect_stderr(err_buf):
+            exec(compile(code, "<block>", "exec"), ns)
+    except BaseException:
+        err_buf.write(traceback.format_exc())
+    out = out_buf.getvalue() or err_buf.getvalue()
+    sys.stdout.write(out)
+    if out and not out.endswith("\n"):
+        sys.stdout.write("\n")
+    sys.stdout.write("__RUNMD_DONE__\n")
+    sys.stdout.flush()
+"""
+
+_workers: dict = {}
+_worker_lock = threading.Lock()
+
+
+def _get_python_worker():
+    with _worker_lock:
+        proc = _workers.get("python")
+        if proc is None or proc.poll() is not None:
+            proc = subprocess.Popen(
+                ["python3", "-u", "-c", _WORKER_SCRIPT],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL)
+            _workers["python"] = proc
+            atexit.register(proc.terminate)
+        return proc
+
+
+def _run_python_worker(code: str, timeout) -> str:
+    proc = _get_python_worker()
+    result = {}
+
+    def _exchange():
+        proc.stdin.write(code.encode("utf-8"))
+        proc.stdin.write(b"\n__RUNMD_END__\n")
+        proc.stdin.flush()
+        chunks = []
+        for raw in proc.stdout:
+            if raw == b"__RUNMD_DONE__\n":
+                result["out"] = b"".join(chunks).decode("utf-8", errors="replace")
+                return
+            chunks.append(raw)
+        result["dead"] = True
+
+    with _worker_lock:
+        t = threading.Thread(target=_exchange, daemon=True)
+        t.start()
+        t.join(timeout)
+        if "out" in result:
+            return result["out"].strip()
+        _workers.pop("python", None)
+        proc.kill()
+        if t.is_alive():
+            return "[error] execution timed out"
+        return "[error] python worker exited unexpectedly"
+
+
+_inproc_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_block(code: str):
+    return compile(code, "<block>", "exec")
+
+
+def run_python_inproc(code: str, globals_dict: dict) -> str:
+    """Execute a python block in this interpreter, sharing globals_dict
+    across blocks notebook-style, and return captured stdout. Skips the
+    subprocess spawn entirely; only for trusted local documents."""
+    buf = io.StringIO()
+    with _inproc_lock:
+        try:
+            with contextlib.redirect_stdout(buf):
+                exec(_compile_block(code), globals_dict)
+        except Exception as e:
+            out = buf.getvalue()
+            return out if out else f"[error] {e}"
+    return buf.getvalue()
+
+
+# Results keyed on (lang, resolved command, blake2b(code)); identical blocks
+# across repeated process_markdown calls skip the subprocess entirely, while
+# a config change to the command invalidates the entry. Only blocks whose
+# output is a pure function of that key may use it: worker-bound python
+# blocks run in a shared namespace, so the same source can legitimately
+# print different things depending on what ran before it. Any future
+# stateful execution path needs the same exclusion.
+_RESULT_CACHE: dict = {}
 
 
 def run_code(lang, code, command_map, timeout: int = 10) -> str:
     if lang not in command_map:
         return f"[error] Language '{lang}' not supported."
 
-    suffix = f".{lang}" if lang.isalnum() else ""
-    tmp = tempfile.NamedTemporaryFile(delete=False, mode="w", encoding="utf-8", suffix=suffix)
-    try:
-        tmp.write(code)
-        tmp.flush()
-        tmp.close()
+    if uses_python_worker(lang, command_map):
+        # Stateful: never cached. The persistent worker already makes these
+        # blocks cheap, so skipping the cache costs nothing.
+        return _run_code_uncached(lang, code, command_map, timeout)
+
+    cache_key = (lang, command_map[lang],
+                 hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest())
+    cached = _RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = _run_code_uncached(lang, code, command_map, timeout)
+    if len(_RESULT_CACHE) < 1024:
+        _RESULT_CACHE[cache_key] = result
+    return result
+
 
-        cmd = command_map[lang](tmp.name)
+def uses_python_worker(lang, command_map) -> bool:
+    """True when a block will run on the persistent python worker. The worker
+    keeps one namespace across blocks, so callers running such blocks
+    concurrently would make document order depend on thread scheduling.
 
-        if not check_dependency_exists(cmd):
+    Compares command by value: a user config that spells out the same command
+    as the default (e.g. one written by --init-config) still counts."""
+    return lang in ("python", "py") and command_map.get(lang) == DEFAULT_LANGUAGES.get(lang)
+
+
+def _run_code_uncached(lang, code, command_map, timeout: int) -> str:
+    if uses_python_worker(lang, command_map):
+        if not check_dependency_exists(["python3"]):
             return f"[error] Required interpreter/compiler for '{lang}' is not installed."
+        try:
+            return _run_python_worker(code, timeout)
+        except Exception as e:
+            return f"[error] {e}"
 
-        proc = subprocess.run(cmd, shell=False, capture_output=True, text=True, timeout=timeout)
+    stdin_cmd = STDIN_CAPABLE.get(lang)
+    if stdin_cmd is not None and command_map[lang] == DEFAULT_LANGUAGES.get(lang):
+        if not check_dependency_exists(stdin_cmd):
+            return f"[error] Required interpreter/compiler for '{lang}' is not installed."
+        try:
+            returncode, out, err = _run_streaming(stdin_cmd, timeout,
+                                                  input_bytes=code.encode("utf-8"))
+            if returncode != 0 and not out:
+                return err.strip()
+            return out.strip()
+        except subprocess.TimeoutExpired:
+            return "[error] execution timed out"
+        except Exception as e:
+            return f"[error] {e}"
 
-        out = proc.stdout or ""
-        err = proc.stderr or ""
-        if proc.returncode != 0 and not out:
-            return err.strip()
-        return out.strip()
-    except subprocess.TimeoutExpired:
-        return "[error] execution timed out"
-    except Exception as e:
-        return f"[error] {e}"
-    finally:
+    suffix = f".{lang}" if lang.isalnum() else ""
+    path, lock = _scratch_path(lang, suffix)
+    with lock:
         try:
-            os.unlink(tmp.name)
-        except Exception:
-            pass
+            with open(path, "w", encoding="utf-8") as tmp:
+                if lang.lower() == "racket" and not code.startswith("#lang"):
+                    tmp.write("#lang racket\n")
+                tmp.write(code)
+
+            cmd = build_cmd(command_map[lang], path)
+
+            if not check_dependency_exists(cmd):
+                return f"[error] Required interpreter/compiler for '{lang}' is not installed."
+
+            returncode, out, err = _run_streaming(cmd, timeout)
+
+            if returncode != 0 and not out:
+                return err.strip()
+            return out.strip()
+        except subprocess.TimeoutExpired:
+            return "[error] execution timed out"
+        except Exception as e:
+            return f"[error] {e}"
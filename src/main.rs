@@ -17,8 +17,9 @@ async fn main() -> Result<()> {
         .about("Run code blocks inside Markdown files and insert their outputs inline")
         .arg(
             Arg::new("file")
-                .help("Markdown file to process")
+                .help("Markdown file(s) to process; several files share one process startup")
                 .required_unless_present("init-config")
+                .num_args(1..)
                 .index(1),
         )
         .arg(
@@ -50,27 +51,30 @@ async fn main() -> Result<()> {
         return Ok(());
     }
 
-    let file_path = matches
-        .get_one::<String>("file")
+    let file_paths: Vec<PathBuf> = matches
+        .get_many::<String>("file")
+        .unwrap()
         .map(PathBuf::from)
-        .unwrap();
-
-    let content = std::fs::read_to_string(&file_path)?;
+        .collect();
 
     let force_parallel = matches.get_flag("parallel");
 
-    let result = if matches.get_flag("clear") {
-        clear_outputs(&content)?
-    } else {
-        process_markdown(&content, force_parallel).await?
-    };
+    for file_path in &file_paths {
+        let content = std::fs::read_to_string(file_path)?;
+
+        let result = if matches.get_flag("clear") {
+            clear_outputs(&content)?
+        } else {
+            process_markdown(&content, force_parallel).await?
+        };
 
-    std::fs::write(&file_path, result)?;
+        std::fs::write(file_path, result)?;
 
-    if matches.get_flag("clear") {
-        println!("Cleared outputs in {}", file_path.display());
-    } else {
-        println!("Processed {}", file_path.display());
+        if matches.get_flag("clear") {
+            println!("Cleared outputs in {}", file_path.display());
+        } else {
+            println!("Processed {}", file_path.display());
+        }
     }
 
     Ok(())